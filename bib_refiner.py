@@ -10,77 +10,276 @@ License: MIT
 """
 
 import argparse
+import functools
+import io
 import os
 import re
+import sqlite3
+import string
 import sys
+import threading
 import time
 import requests
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from difflib import SequenceMatcher
-from habanero import Crossref, cn
-from lxml import etree
+from requests.adapters import HTTPAdapter
+
+try:
+    # orjson 为可选依赖，解析 Semantic Scholar 批量结果等较大的响应时明显更快
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+
+# 全局 HTTP 会话：复用 keep-alive 连接，避免每次查询都重新进行 TCP+TLS 握手
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+SESSION.headers.update({
+    'User-Agent': 'bib_refiner/1.0 (https://github.com/SwapForward/bib_refiner)'
+})
+
+# 每个服务器允许的并发请求数，避免并行查询超出各数据源的速率限制
+_HOST_LIMITS = {
+    'api.semanticscholar.org': threading.BoundedSemaphore(2),
+    'dblp.org': threading.BoundedSemaphore(2),
+    'api.crossref.org': threading.BoundedSemaphore(2),
+}
+
+# 同一服务器两次请求之间的最小间隔（秒），只限制实际访问的服务器，不再统一等待
+_MIN_INTERVAL = {
+    'api.semanticscholar.org': 1.0,
+    'dblp.org': 1.0,
+    'api.crossref.org': 0.1,
+}
+_LAST_CALL = {}  # host -> 最近一次（已预约的）请求时间，time.monotonic()
+_LAST_CALL_LOCK = threading.Lock()
+
+# Crossref REST API
+_CR_BASE = 'https://api.crossref.org'
+
+# arXiv 在 DataCite 注册的 DOI 前缀，Crossref 无法解析
+_DATACITE_ARXIV_DOI_PREFIX = '10.48550/'
+
+# 预编译的正则表达式（BibTeX 解析与格式化）
+_ENTRY_START_RE = re.compile(r'@(\w+)\{')
+_TITLE_START_RE = re.compile(r'title\s*=\s*\{', re.IGNORECASE)
+_AUTHOR_START_RE = re.compile(r'author\s*=\s*\{', re.IGNORECASE)
+_BRACE_CONTENT_RE = re.compile(r'\{([^{}]+)\}')
+_CITKEY_RE = re.compile(r'(@\w+\{)([^,]+)(,)')
+_ENTRY_KEY_RE = re.compile(r'@\w+\{\s*([^,\s]+)\s*,')
+_SINGLE_LINE_ENTRY_RE = re.compile(r'(@\w+\{)([^,]+)(,\s*)(.*?)(\s*\})\s*$', re.DOTALL)
+_FIELD_RE = re.compile(r'\s*(\w+)\s*=\s*')
+_BARE_VALUE_RE = re.compile(r'[^,}]*')
+_WS_RE = re.compile(r'\s+')
+_DOI_FIELD_RE = re.compile(r'\bdoi\s*=\s*[{"]\s*(?:https?://(?:dx\.)?doi\.org/)?(10\.[^\s{}"]+)', re.IGNORECASE)
+_ARXIV_ID_RE = re.compile(r'(?:arxiv(?:\.org/abs/)?[:\s/]*|\beprint\s*=\s*[{"]\s*)(\d{4}\.\d{4,5})', re.IGNORECASE)
+_AND_RE = re.compile(r'\s+and\s+')
+
+# 标题清理表：连字符、冒号、括号等替换为空格（避免单词粘连），其余标点直接删除
+_SPACE_CHARS = '-:/\\()[]{}'
+_CLEAN_TABLE = str.maketrans({
+    c: ' ' if c in _SPACE_CHARS else None for c in string.punctuation
+})
+
+# 计算标题相似度时忽略的常见停用词
+_STOP_WORDS = frozenset({'a', 'an', 'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'from'})
+
+# 数据源按优先级排列（从高到低）
+PROVIDERS = ('semantic', 'dblp', 'crossref')
+PROVIDER_NAMES = {'semantic': 'Semantic Scholar', 'dblp': 'DBLP', 'crossref': 'Crossref'}
+
+# 线程私有的输出缓冲：并发查询时先缓存各自的输出，再按顺序整体打印，避免日志交错
+_OUTPUT = threading.local()
+
+
+def log(*args, **kwargs):
+    """与 print 相同；若当前线程开启了输出缓冲，则写入缓冲区"""
+    buffer = getattr(_OUTPUT, 'buffer', None)
+    if buffer is None:
+        print(*args, **kwargs)
+    else:
+        print(*args, file=buffer, **kwargs)
 
 
-def calculate_similarity(str1, str2, debug=False):
+def run_buffered(func, *args, **kwargs):
     """
-    计算两个字符串的相似度（0-1之间）
-    基于单词匹配：统计查询结果中有多少单词在原标题中出现
-    忽略大小写和标点符号
+    在当前线程中执行 func，并捕获其通过 log 输出的内容
+    返回 (func 的返回值, 输出文本)
     """
-    import string
+    previous = getattr(_OUTPUT, 'buffer', None)
+    _OUTPUT.buffer = io.StringIO()
+    try:
+        result = func(*args, **kwargs)
+        return result, _OUTPUT.buffer.getvalue()
+    finally:
+        _OUTPUT.buffer = previous
 
-    # 清理和统一大小写
-    str1_lower = str1.lower().strip()
-    str2_lower = str2.lower().strip()
 
-    # 先将连字符、冒号等替换为空格，避免单词粘连
-    # 例如 "Video-to-Audio" -> "Video to Audio"
-    for char in ['-', ':', '/', '\\', '(', ')', '[', ']', '{', '}']:
-        str1_lower = str1_lower.replace(char, ' ')
-        str2_lower = str2_lower.replace(char, ' ')
+class QueryCancelled(Exception):
+    """更高优先级的数据源已经成功，本次查询不再需要"""
 
-    # 移除其他标点符号
-    translator = str.maketrans('', '', string.punctuation)
-    str1_clean = str1_lower.translate(translator)
-    str2_clean = str2_lower.translate(translator)
 
-    # 提取单词
-    words1 = set(str1_clean.split())
-    words2 = set(str2_clean.split())
+def _wait_for_host(host, cancel=None):
+    """
+    距离上次访问同一服务器不足最小间隔时等待，并预约本次请求的时间
+    cancel（threading.Event）被设置时放弃请求，抛出 QueryCancelled
+    """
+    if cancel is not None and cancel.is_set():
+        raise QueryCancelled()
+    interval = _MIN_INTERVAL.get(host)
+    if not interval:
+        return
+    with _LAST_CALL_LOCK:
+        now = time.monotonic()
+        start = max(now, _LAST_CALL.get(host, now - interval) + interval)
+        _LAST_CALL[host] = start
+    if cancel is None:
+        time.sleep(start - now)
+    elif cancel.wait(start - now):
+        raise QueryCancelled()
+
+
+def http_request(method, url, cancel=None, **kwargs):
+    """
+    通过全局会话发送 HTTP 请求，并遵守对应服务器的并发上限和请求间隔
+    cancel（threading.Event）被设置时不再发出请求，抛出 QueryCancelled
+    """
+    host = urllib.parse.urlsplit(url).hostname
+    limit = _HOST_LIMITS.get(host)
+    if limit is None:
+        _wait_for_host(host, cancel)
+        return SESSION.request(method, url, **kwargs)
+    with limit:
+        _wait_for_host(host, cancel)
+        return SESSION.request(method, url, **kwargs)
 
-    # 过滤掉常见停用词
-    stop_words = {'a', 'an', 'the', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'from'}
-    words1 = words1 - stop_words
-    words2 = words2 - stop_words
 
-    # 移除空字符串
-    words1 = {w for w in words1 if w}
-    words2 = {w for w in words2 if w}
+def http_get(url, **kwargs):
+    """发送 GET 请求（见 http_request）"""
+    return http_request('GET', url, **kwargs)
 
-    if not words1 or not words2:
-        return 0.0
 
-    # 计算交集和并集
-    intersection = words1 & words2
-    union = words1 | words2
+def _tokenize(text):
+    """
+    将标题清理为单词集合：忽略大小写和标点符号，并去掉常见停用词
+    """
+    # 一次 translate 完成全部清理，例如 "Video-to-Audio" -> "video to audio"
+    words = text.lower().translate(_CLEAN_TABLE).split()
+    return frozenset(words).difference(_STOP_WORDS)
+
+
+def normalize_title(title):
+    """规范化标题（排序后的单词），用作缓存键，使大小写、标点和词序差异不影响命中"""
+    return ' '.join(sorted(_tokenize(title)))
+
 
-    # Jaccard 相似度 (交集/并集)
-    jaccard_similarity = len(intersection) / len(union) if union else 0.0
+def _jaccard_coverage(words1, words2):
+    """
+    计算两个单词集合的 (Jaccard 相似度, 覆盖率)
+    覆盖率：查询结果的单词（words2）有多少在原标题（words1）中出现
+    """
+    intersection = len(words1 & words2)
+    union = len(words1) + len(words2) - intersection
+    jaccard_similarity = intersection / union if union else 0.0
+    coverage = intersection / len(words2) if words2 else 0.0
+    return jaccard_similarity, coverage
 
-    # 覆盖率（查询结果的单词有多少在原标题中）
-    coverage = len(intersection) / len(words2) if words2 else 0.0
+
+def calculate_similarity(str1, str2, debug=False, tokens1=None, threshold=None):
+    """
+    计算两个字符串的相似度（0-1之间）
+    基于单词匹配：统计查询结果中有多少单词在原标题中出现
+    忽略大小写和标点符号
+    tokens1 为 str1 预先分词的结果（可选），同一标题与多个数据源比较时避免重复清理
+    给出 threshold 时，略低于阈值的结果再用字符级相似度复核
+    """
+    words1 = tokens1 if tokens1 is not None else _tokenize(str1)
+    words2 = _tokenize(str2)
+
+    if not words1 or not words2:
+        return 0.0
+
+    jaccard_similarity, coverage = _jaccard_coverage(words1, words2)
 
     # 调试模式：打印详细信息
     if debug:
-        print(f"  [调试] 原标题单词: {sorted(words1)}")
-        print(f"  [调试] 查询结果单词: {sorted(words2)}")
-        print(f"  [调试] 交集单词: {sorted(intersection)}")
-        print(f"  [调试] 交集数/原标题数/查询结果数: {len(intersection)}/{len(words1)}/{len(words2)}")
-        print(f"  [调试] Jaccard={jaccard_similarity:.2%}, 覆盖率={coverage:.2%}")
+        log(f"  [调试] 原标题单词: {sorted(words1)}")
+        log(f"  [调试] 查询结果单词: {sorted(words2)}")
+        intersection = words1 & words2
+        log(f"  [调试] 交集单词: {sorted(intersection)}")
+        log(f"  [调试] 交集数/原标题数/查询结果数: {len(intersection)}/{len(words1)}/{len(words2)}")
+        log(f"  [调试] Jaccard={jaccard_similarity:.2%}, 覆盖率={coverage:.2%}")
 
     # 取两者的加权平均，覆盖率权重更高（更重要）
     # 如果查询结果的大部分单词都在原标题中，说明很可能是同一篇论文
-    return 0.3 * jaccard_similarity + 0.7 * coverage
+    similarity = 0.3 * jaccard_similarity + 0.7 * coverage
+
+    # 低于阈值不足 0.1 时，用字符级相似度复核，避免单词拼写差异（如单复数、连写）导致漏匹配
+    # quick_ratio（O(n) 的字符统计）只作为廉价的预筛，真正提高分数的是更严格的 ratio()
+    if threshold is not None and threshold - 0.1 <= similarity < threshold:
+        matcher = SequenceMatcher(None, ' '.join(sorted(words1)), ' '.join(sorted(words2)))
+        if matcher.quick_ratio() >= threshold:
+            char_ratio = matcher.ratio()
+            if debug:
+                log(f"  [调试] 临界区间，字符相似度={char_ratio:.2%}")
+            similarity = max(similarity, char_ratio)
+
+    return similarity
+
+
+def _find_matching_brace(s, i):
+    """
+    从位置 i 开始（位于一个已打开的 { 之后）查找与之匹配的 }
+    返回该 } 之后的位置；花括号不匹配时返回 -1
+    用 str.find 在花括号之间跳跃，而不是逐个字符扫描
+    """
+    depth = 1
+    next_open = s.find('{', i)
+    while True:
+        close = s.find('}', i)
+        if close == -1:
+            return -1
+        # 统计这个 } 之前新打开的 {
+        while next_open != -1 and next_open < close:
+            depth += 1
+            next_open = s.find('{', next_open + 1)
+        depth -= 1
+        if depth == 0:
+            return close + 1
+        i = close + 1
+
+
+def best_candidate(title, candidate_titles, query_tokens=None):
+    """
+    从多个候选标题中选出与原标题最相似的一个，返回其下标
+    原标题只分词一次，每个候选只做一次清理和集合运算
+    """
+    if len(candidate_titles) <= 1:
+        return 0
+    if query_tokens is None:
+        query_tokens = _tokenize(title)
+    scores = [calculate_similarity(title, candidate, tokens1=query_tokens) for candidate in candidate_titles]
+    return max(range(len(scores)), key=scores.__getitem__)
+
+
+@functools.lru_cache(maxsize=4096)
+def _clean_title_braces(title):
+    """清理 BibTeX 格式的花括号（如 {MMAudio} -> MMAudio），但保留实际内容中的花括号"""
+    return _BRACE_CONTENT_RE.sub(r'\1', title)
+
+
+def index_entries_by_key(content):
+    """
+    快速建立 {citation_key: 完整条目} 索引（用于断点续传）
+    只做一次正则扫描和花括号匹配，不解析标题等字段
+    """
+    entries = {}
+    for match in _ENTRY_KEY_RE.finditer(content):
+        end = _find_matching_brace(content, content.index('{', match.start()) + 1)
+        if end != -1:
+            entries[match.group(1)] = content[match.start():end]
+    return entries
 
 
 def extract_bibtex_entries(content):
@@ -93,21 +292,13 @@ def extract_bibtex_entries(content):
     # 手动解析 BibTeX 条目，支持多层嵌套花括号
     # 找到所有 @entrytype{ 的位置
     entry_starts = []
-    for match in re.finditer(r'@(\w+)\{', content):
+    for match in _ENTRY_START_RE.finditer(content):
         entry_starts.append((match.start(), match.group(1), match.end()))
 
     for i, (start_pos, entry_type, brace_start) in enumerate(entry_starts):
         # 找到对应的闭合花括号
-        brace_count = 1
-        pos = brace_start
-        while pos < len(content) and brace_count > 0:
-            if content[pos] == '{':
-                brace_count += 1
-            elif content[pos] == '}':
-                brace_count -= 1
-            pos += 1
-
-        if brace_count != 0:
+        pos = _find_matching_brace(content, brace_start)
+        if pos == -1:
             # 花括号不匹配，跳过
             continue
 
@@ -125,25 +316,16 @@ def extract_bibtex_entries(content):
 
         # 提取 title（改进版：处理嵌套花括号）
         # 先找到 title = { 的位置
-        title_start_match = re.search(r'title\s*=\s*\{', entry_content, re.IGNORECASE)
+        title_start_match = _TITLE_START_RE.search(entry_content)
         if title_start_match:
             start_pos = title_start_match.end()
             # 从这个位置开始，匹配对应的闭合花括号
-            brace_count = 1
-            pos = start_pos
-            while pos < len(entry_content) and brace_count > 0:
-                if entry_content[pos] == '{':
-                    brace_count += 1
-                elif entry_content[pos] == '}':
-                    brace_count -= 1
-                pos += 1
-
-            if brace_count == 0:
+            pos = _find_matching_brace(entry_content, start_pos)
+            if pos != -1:
                 title = entry_content[start_pos:pos-1].strip()
 
                 # 清理 BibTeX 格式的花括号（如 {MMAudio} -> MMAudio）
-                # 但保留实际内容中的花括号
-                title_clean = re.sub(r'\{([^{}]+)\}', r'\1', title)
+                title_clean = _clean_title_braces(title)
 
                 entries.append({
                     'citation_key': citation_key,
@@ -159,47 +341,85 @@ def extract_bibtex_entries(content):
     return entries
 
 
-def get_bib_from_crossref(title, citation_key, similarity_threshold=0.7):
+def crossref_bibtex(doi, mailto=None, cancel=None):
+    """
+    通过 Crossref 的 transform 接口获取 DOI 对应的 BibTeX
+    遇到速率限制 (429) 时记录日志并返回 None；响应为空时返回空字符串
+    """
+    params = {'mailto': mailto} if mailto else None
+    response = http_get(
+        f"{_CR_BASE}/works/{urllib.parse.quote(doi)}/transform/application/x-bibtex",
+        params=params,
+        timeout=10,
+        cancel=cancel
+    )
+    if response.status_code == 429:
+        log(f"  [Crossref] ⚠ 速率限制 (429)")
+        return None
+    response.raise_for_status()
+    return response.text.strip()
+
+
+def get_bib_from_crossref(title, citation_key, similarity_threshold=0.7, query_tokens=None, mailto=None,
+                          candidates=1, cancel=None):
     """使用 Crossref 获取 BibTeX，并验证标题相似度"""
     try:
-        print(f"  [Crossref] 正在查询...")
-        cr = Crossref()
+        log(f"  [Crossref] 正在查询...")
 
-        # 搜索标题，取第一个结果
-        result = cr.works(query=title, limit=1)
+        # 搜索标题，取前 candidates 个结果（提供 mailto 可进入 Crossref 的 polite pool）
+        params = {'query.bibliographic': title, 'rows': candidates}
+        if mailto:
+            params['mailto'] = mailto
+        response = http_get(f"{_CR_BASE}/works", params=params, timeout=10, cancel=cancel)
+
+        # 检查速率限制
+        if response.status_code == 429:
+            log(f"  [Crossref] ⚠ 速率限制 (429)")
+            return None
+
+        response.raise_for_status()
+        result = _json_loads(response.content)
 
         if not result['message']['items']:
-            print(f"  [Crossref] ✗ 未找到结果")
+            log(f"  [Crossref] ✗ 未找到结果")
             return None
 
-        item = result['message']['items'][0]
+        # 从候选结果中选出标题最相似的一个
+        items = result['message']['items']
+        item = items[best_candidate(title, [(i.get('title') or [''])[0] for i in items], query_tokens)]
         doi = item['DOI']
         found_title = item.get('title', [''])[0]
         found_author = item.get('author', [{}])[0].get('family', 'N/A')
         found_year = item.get('published', {}).get('date-parts', [[None]])[0][0] or \
                     item.get('created', {}).get('date-parts', [[None]])[0][0] or 'N/A'
 
-        print(f"  [Crossref] ✓ 找到: {found_title}")
-        print(f"             DOI: {doi}")
-        print(f"             作者: {found_author} et al.")
-        print(f"             年份: {found_year}")
+        log(f"  [Crossref] ✓ 找到: {found_title}")
+        log(f"             DOI: {doi}")
+        log(f"             作者: {found_author} et al.")
+        log(f"             年份: {found_year}")
 
         # 验证标题相似度（启用调试模式）
-        similarity = calculate_similarity(title, found_title, debug=True)
+        similarity = calculate_similarity(title, found_title, debug=True, tokens1=query_tokens,
+                                          threshold=similarity_threshold)
         similarity_percent = similarity * 100
 
-        print(f"             相似度: {similarity_percent:.1f}%", end="")
+        log(f"             相似度: {similarity_percent:.1f}%", end="")
 
         # 判断相似度是否达标
         if similarity < similarity_threshold:
-            print(f" ✗ (低于 {similarity_threshold*100:.0f}% 阈值)")
-            print(f"  [Crossref] ⚠ 标题不匹配")
+            log(f" ✗ (低于 {similarity_threshold*100:.0f}% 阈值)")
+            log(f"  [Crossref] ⚠ 标题不匹配")
             return None
         else:
-            print(f" ✓")
+            log(f" ✓")
 
         # 通过 DOI 获取 BibTeX 格式
-        bib_data = cn.content_negotiation(ids=doi, format='bibentry')
+        bib_data = crossref_bibtex(doi, mailto=mailto, cancel=cancel)
+        if bib_data is None:
+            return None
+        if not bib_data:
+            log(f"  [Crossref] ✗ 无法获取 BibTeX")
+            return None
 
         # 替换引用键
         bib_data_updated = replace_citation_key_in_bibtex(bib_data, citation_key)
@@ -207,39 +427,75 @@ def get_bib_from_crossref(title, citation_key, similarity_threshold=0.7):
         return bib_data_updated
 
     except Exception as e:
-        print(f"  [Crossref] ✗ 错误: {e}")
+        log(f"  [Crossref] ✗ 错误: {e}")
+        return None
+
+
+def semantic_scholar_bibtex(paper, headers=None, mailto=None, cancel=None):
+    """
+    获取 Semantic Scholar 论文的 BibTeX
+    有 Crossref 可解析的 DOI 时从 Crossref 获取规范的 BibTeX；否则（如 arXiv 预印本）
+    或 Crossref 失败时，才按 paperId 单独请求选中论文的 citationStyles
+    """
+    doi = (paper.get('externalIds') or {}).get('DOI')
+    # arXiv 的 DataCite DOI（10.48550/arXiv.*）不在 Crossref 中，直接跳过
+    if doi and not doi.startswith(_DATACITE_ARXIV_DOI_PREFIX):
+        try:
+            bibtex = crossref_bibtex(doi, mailto=mailto, cancel=cancel)
+            if bibtex:
+                log(f"  [Semantic Scholar] 已通过 DOI 从 Crossref 获取 BibTeX")
+                return bibtex
+        except QueryCancelled:
+            raise
+        except Exception as e:
+            log(f"  [Semantic Scholar] ⚠ Crossref 获取 BibTeX 失败: {e}，改用 citationStyles")
+
+    response = http_get(
+        f"https://api.semanticscholar.org/graph/v1/paper/{paper['paperId']}",
+        params={'fields': 'citationStyles'},
+        headers=headers,
+        timeout=10,
+        cancel=cancel
+    )
+    if response.status_code == 429:
+        log(f"  [Semantic Scholar] ⚠ 速率限制 (429)")
         return None
+    response.raise_for_status()
+    return (_json_loads(response.content).get('citationStyles') or {}).get('bibtex')
 
 
-def get_bib_from_semantic_scholar(title, citation_key, api_key=None, similarity_threshold=0.70):
+def get_bib_from_semantic_scholar(title, citation_key, api_key=None, similarity_threshold=0.70,
+                                  query_tokens=None, mailto=None, candidates=1, cancel=None):
     """使用 Semantic Scholar API 获取 BibTeX，并验证标题相似度"""
     try:
-        print(f"  [Semantic Scholar] 正在查询...")
+        log(f"  [Semantic Scholar] 正在查询...")
 
         # 构建请求 URL
         query = urllib.parse.quote(title)
-        search_url = f"https://api.semanticscholar.org/graph/v1/paper/search?query={query}&limit=1&fields=paperId,title,authors,year,venue,citationStyles"
+        search_url = f"https://api.semanticscholar.org/graph/v1/paper/search?query={query}&limit={candidates}&fields=paperId,title,authors,year,venue,externalIds"
 
         # 设置请求头（如果有 API key）
         headers = {}
         if api_key:
             headers['x-api-key'] = api_key
 
-        response = requests.get(search_url, headers=headers, timeout=10)
+        response = http_get(search_url, headers=headers, timeout=10, cancel=cancel)
 
         # 检查速率限制
         if response.status_code == 429:
-            print(f"  [Semantic Scholar] ⚠ 速率限制 (429)")
+            log(f"  [Semantic Scholar] ⚠ 速率限制 (429)")
             return None
 
         response.raise_for_status()
-        result = response.json()
+        result = _json_loads(response.content)
 
         if not result.get('data'):
-            print(f"  [Semantic Scholar] ✗ 未找到结果")
+            log(f"  [Semantic Scholar] ✗ 未找到结果")
             return None
 
-        paper = result['data'][0]
+        # 从候选结果中选出标题最相似的一个
+        papers = result['data']
+        paper = papers[best_candidate(title, [p.get('title') or '' for p in papers], query_tokens)]
         found_title = paper.get('title', '')
         found_authors = paper.get('authors', [])
         found_year = paper.get('year', 'N/A')
@@ -250,29 +506,30 @@ def get_bib_from_semantic_scholar(title, citation_key, api_key=None, similarity_
         if len(found_authors) > 3:
             author_names += ' et al.'
 
-        print(f"  [Semantic Scholar] ✓ 找到: {found_title}")
-        print(f"                     作者: {author_names}")
-        print(f"                     年份: {found_year}")
-        print(f"                     会议/期刊: {found_venue}")
+        log(f"  [Semantic Scholar] ✓ 找到: {found_title}")
+        log(f"                     作者: {author_names}")
+        log(f"                     年份: {found_year}")
+        log(f"                     会议/期刊: {found_venue}")
 
         # 验证标题相似度（启用调试模式）
-        similarity = calculate_similarity(title, found_title, debug=True)
+        similarity = calculate_similarity(title, found_title, debug=True, tokens1=query_tokens,
+                                          threshold=similarity_threshold)
         similarity_percent = similarity * 100
 
-        print(f"                     相似度: {similarity_percent:.1f}%", end="")
+        log(f"                     相似度: {similarity_percent:.1f}%", end="")
 
         # 判断相似度是否达标
         if similarity < similarity_threshold:
-            print(f" ✗ (低于 {similarity_threshold*100:.0f}% 阈值)")
-            print(f"  [Semantic Scholar] ⚠ 标题不匹配")
+            log(f" ✗ (低于 {similarity_threshold*100:.0f}% 阈值)")
+            log(f"  [Semantic Scholar] ⚠ 标题不匹配")
             return None
         else:
-            print(f" ✓")
+            log(f" ✓")
 
-        # 获取 BibTeX
-        bibtex = paper.get('citationStyles', {}).get('bibtex')
+        # 获取 BibTeX（优先通过 DOI 从 Crossref 获取）
+        bibtex = semantic_scholar_bibtex(paper, headers=headers, mailto=mailto, cancel=cancel)
         if not bibtex:
-            print(f"  [Semantic Scholar] ✗ 无法获取 BibTeX")
+            log(f"  [Semantic Scholar] ✗ 无法获取 BibTeX")
             return None
 
         # 替换引用键
@@ -281,92 +538,153 @@ def get_bib_from_semantic_scholar(title, citation_key, api_key=None, similarity_
         return bibtex_updated
 
     except Exception as e:
-        print(f"  [Semantic Scholar] ✗ 错误: {e}")
+        log(f"  [Semantic Scholar] ✗ 错误: {e}")
         return None
 
 
-def get_bib_from_dblp(title, citation_key, similarity_threshold=0.7):
-    """使用 DBLP 获取 BibTeX，并验证标题相似度"""
+def extract_paper_id(full_entry):
+    """
+    从原始条目中提取 Semantic Scholar 可识别的论文标识符（优先 DOI，其次 arXiv ID）
+    返回如 'DOI:10.xxx' 或 'ARXIV:2301.12345'，没有时返回 None
+    """
+    doi_match = _DOI_FIELD_RE.search(full_entry)
+    if doi_match:
+        return 'DOI:' + doi_match.group(1)
+    arxiv_match = _ARXIV_ID_RE.search(full_entry)
+    if arxiv_match:
+        return 'ARXIV:' + arxiv_match.group(1)
+    return None
+
+
+def prefetch_semantic_scholar(entries, api_key=None, similarity_threshold=0.7):
+    """
+    通过 Semantic Scholar 的 /paper/batch 接口，用一次请求（每批最多 500 个）查询
+    所有带 DOI / arXiv ID 的条目，标题相似度验证通过的直接采用
+    返回 {citation_key: bibtex}；未命中的条目仍走逐条查询
+    """
+    ids = {}  # citation_key -> paper id
+    for entry in entries:
+        paper_id = extract_paper_id(entry['full_entry'])
+        if paper_id:
+            ids[entry['citation_key']] = paper_id
+    if not ids:
+        return {}
+
+    print(f"Semantic Scholar 批量查询: {len(ids)} 个条目带有 DOI/arXiv 标识符")
+
+    headers = {}
+    if api_key:
+        headers['x-api-key'] = api_key
+
+    titles = {entry['citation_key']: entry['title'] for entry in entries}
+    keys = list(ids)
+    found = {}
     try:
-        print(f"  [DBLP] 正在查询...")
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            response = http_request(
+                'POST',
+                'https://api.semanticscholar.org/graph/v1/paper/batch',
+                params={'fields': 'paperId,title,citationStyles'},
+                json={'ids': [ids[key] for key in chunk]},
+                headers=headers,
+                timeout=30
+            )
+            if response.status_code == 429:
+                print("⚠ Semantic Scholar 批量查询遇到速率限制 (429)，改为逐条查询")
+                break
+            response.raise_for_status()
+
+            # 返回结果与请求的标识符一一对应，无法识别的为 null
+            for key, paper in zip(chunk, _json_loads(response.content)):
+                if not paper:
+                    continue
+                similarity = calculate_similarity(titles[key], paper.get('title') or '',
+                                                  threshold=similarity_threshold)
+                bibtex = (paper.get('citationStyles') or {}).get('bibtex')
+                if similarity >= similarity_threshold and bibtex:
+                    found[key] = replace_citation_key_in_bibtex(bibtex, key)
+    except Exception as e:
+        print(f"⚠ Semantic Scholar 批量查询失败: {e}，改为逐条查询")
 
-        # 构建搜索 URL
-        query = urllib.parse.quote(title)
-        search_url = f"https://dblp.org/search?q={query}"
+    print(f"Semantic Scholar 批量查询命中 {len(found)} 个\n")
+    return found
 
-        # 发送搜索请求
-        response = requests.get(search_url, timeout=10)
+
+def get_bib_from_dblp(title, citation_key, similarity_threshold=0.7, query_tokens=None, candidates=1,
+                      cancel=None):
+    """使用 DBLP 获取 BibTeX，并验证标题相似度"""
+    try:
+        log(f"  [DBLP] 正在查询...")
+
+        # 使用 DBLP 的 JSON 搜索接口，取前 candidates 个结果
+        response = http_get(
+            'https://dblp.org/search/publ/api',
+            params={'q': title, 'format': 'json', 'h': candidates},
+            timeout=10,
+            cancel=cancel
+        )
 
         # 检查速率限制
         if response.status_code == 429:
-            print(f"  [DBLP] ⚠ 速率限制 (429)")
+            log(f"  [DBLP] ⚠ 速率限制 (429)")
             return None
 
         response.raise_for_status()
 
-        # 解析 HTML，找到 BibTeX 链接
-        html = etree.HTML(response.content)
-        bibtex_links = html.xpath('//a[contains(@href, "?view=bibtex")]/@href')
-
-        if not bibtex_links:
-            print(f"  [DBLP] ✗ 未找到结果")
+        hits = _json_loads(response.content).get('result', {}).get('hits', {}).get('hit', [])
+        if not hits:
+            log(f"  [DBLP] ✗ 未找到结果")
             return None
 
-        # 取第一个结果，并转换为 .bib URL
-        bibtex_link = bibtex_links[0]
-        bib_url = bibtex_link.replace('.html?view=bibtex', '.bib')
+        # 从候选结果中选出标题最相似的一个，由其 DBLP 记录键得到 .bib URL
+        hit = hits[best_candidate(title, [h['info'].get('title', '') for h in hits], query_tokens)]
+        bib_url = f"https://dblp.org/rec/{hit['info']['key']}.bib"
 
         # 下载 BibTeX
-        bib_response = requests.get(bib_url, timeout=10)
+        bib_response = http_get(bib_url, timeout=10, cancel=cancel)
 
         # 再次检查速率限制
         if bib_response.status_code == 429:
-            print(f"  [DBLP] ⚠ 速率限制 (429)")
+            log(f"  [DBLP] ⚠ 速率限制 (429)")
             return None
 
         bib_response.raise_for_status()
         bibtex = bib_response.text.strip()
 
         # 从 BibTeX 中提取标题以验证相似度（处理嵌套花括号）
-        title_start_match = re.search(r'title\s*=\s*\{', bibtex, re.IGNORECASE)
+        title_start_match = _TITLE_START_RE.search(bibtex)
         if not title_start_match:
-            print(f"  [DBLP] ✗ 无法从 BibTeX 提取标题")
+            log(f"  [DBLP] ✗ 无法从 BibTeX 提取标题")
             return None
 
         start_pos = title_start_match.end()
         # 从这个位置开始，匹配对应的闭合花括号
-        brace_count = 1
-        pos = start_pos
-        while pos < len(bibtex) and brace_count > 0:
-            if bibtex[pos] == '{':
-                brace_count += 1
-            elif bibtex[pos] == '}':
-                brace_count -= 1
-            pos += 1
-
-        if brace_count != 0:
-            print(f"  [DBLP] ✗ 无法从 BibTeX 提取标题（花括号不匹配）")
+        pos = _find_matching_brace(bibtex, start_pos)
+        if pos == -1:
+            log(f"  [DBLP] ✗ 无法从 BibTeX 提取标题（花括号不匹配）")
             return None
 
         found_title = bibtex[start_pos:pos-1].strip()
         # 清理 BibTeX 格式的花括号（如 {MMAudio} -> MMAudio）
-        found_title = re.sub(r'\{([^{}]+)\}', r'\1', found_title)
+        found_title = _clean_title_braces(found_title)
 
-        print(f"  [DBLP] ✓ 找到: {found_title[:60]}...")
+        log(f"  [DBLP] ✓ 找到: {found_title[:60]}...")
 
         # 验证标题相似度（启用调试模式）
-        similarity = calculate_similarity(title, found_title, debug=True)
+        similarity = calculate_similarity(title, found_title, debug=True, tokens1=query_tokens,
+                                          threshold=similarity_threshold)
         similarity_percent = similarity * 100
 
-        print(f"         相似度: {similarity_percent:.1f}%", end="")
+        log(f"         相似度: {similarity_percent:.1f}%", end="")
 
         # 判断相似度是否达标
         if similarity < similarity_threshold:
-            print(f" ✗ (低于 {similarity_threshold*100:.0f}% 阈值)")
-            print(f"  [DBLP] ⚠ 标题不匹配")
+            log(f" ✗ (低于 {similarity_threshold*100:.0f}% 阈值)")
+            log(f"  [DBLP] ⚠ 标题不匹配")
             return None
         else:
-            print(f" ✓")
+            log(f" ✓")
 
         # 替换引用键
         bibtex_updated = replace_citation_key_in_bibtex(bibtex, citation_key)
@@ -377,7 +695,7 @@ def get_bib_from_dblp(title, citation_key, similarity_threshold=0.7):
         return bibtex_cleaned
 
     except Exception as e:
-        print(f"  [DBLP] ✗ 错误: {e}")
+        log(f"  [DBLP] ✗ 错误: {e}")
         return None
 
 
@@ -403,10 +721,8 @@ def replace_citation_key_in_bibtex(bibtex, new_key):
     替换 BibTeX 中的引用键
     将 @entrytype{原键, 替换为 @entrytype{新键,
     """
-    # 匹配 @entrytype{citation_key,
-    pattern = r'(@\w+\{)([^,]+)(,)'
-    replacement = r'\1' + new_key + r'\3'
-    new_bibtex = re.sub(pattern, replacement, bibtex, count=1)
+    # 匹配 @entrytype{citation_key,（用函数替换，避免新键中的数字或反斜杠被当作分组引用）
+    new_bibtex = _CITKEY_RE.sub(lambda m: m.group(1) + new_key + m.group(3), bibtex, count=1)
     return new_bibtex.strip()
 
 
@@ -414,13 +730,18 @@ def truncate_authors(author_field, max_authors=5):
     """
     截断作者列表，超过 max_authors 个作者时只保留前 max_authors 个并添加 'and others'
     """
+    return _truncate_authors_cached(author_field, max_authors)
+
+
+@functools.lru_cache(maxsize=4096)
+def _truncate_authors_cached(author_field, max_authors=5):
+    """truncate_authors 的实际实现；结果只取决于输入字符串，相同的作者列表直接复用"""
     # 按 'and' 分割作者（注意前后要有空格或换行）
-    import re
     # 先统一格式：将所有换行符和多余空格替换为单个空格
-    author_clean = re.sub(r'\s+', ' ', author_field.strip())
+    author_clean = _WS_RE.sub(' ', author_field.strip())
 
     # 按 ' and ' 分割（注意两边有空格）
-    authors = re.split(r'\s+and\s+', author_clean)
+    authors = _AND_RE.split(author_clean)
 
     if len(authors) > max_authors:
         # 只保留前 max_authors 个作者
@@ -438,7 +759,7 @@ def format_bibtex(bibtex):
     if '\n' not in bibtex or bibtex.count('\n') <= 1:
         # 单行格式，需要拆分成多行
         # 匹配 @entrytype{key, field1={...}, field2={...}, ... }
-        entry_match = re.match(r'(@\w+\{)([^,]+)(,\s*)(.*?)(\s*\})\s*$', bibtex.strip(), re.DOTALL)
+        entry_match = _SINGLE_LINE_ENTRY_RE.match(bibtex.strip())
         if not entry_match:
             # 无法解析，直接返回
             return bibtex
@@ -450,40 +771,26 @@ def format_bibtex(bibtex):
         fields = []
         pos = 0
         while pos < len(fields_str):
-            # 跳过空白
-            while pos < len(fields_str) and fields_str[pos].isspace():
-                pos += 1
-            if pos >= len(fields_str):
-                break
-
-            # 匹配字段名
-            field_match = re.match(r'(\w+)\s*=\s*', fields_str[pos:])
+            # 匹配字段名（连同前面的空白），直接在原字符串的 pos 处匹配，不复制切片
+            field_match = _FIELD_RE.match(fields_str, pos)
             if not field_match:
                 break
 
             field_name = field_match.group(1)
-            pos += field_match.end()
+            pos = field_match.end()
 
             # 提取字段值
             if pos < len(fields_str) and fields_str[pos] == '{':
-                # 值用花括号包围
-                brace_count = 0
+                # 值用花括号包围（花括号不匹配时取到末尾）
                 value_start = pos
-                while pos < len(fields_str):
-                    if fields_str[pos] == '{':
-                        brace_count += 1
-                    elif fields_str[pos] == '}':
-                        brace_count -= 1
-                        if brace_count == 0:
-                            pos += 1
-                            break
-                    pos += 1
+                pos = _find_matching_brace(fields_str, pos + 1)
+                if pos == -1:
+                    pos = len(fields_str)
                 value = fields_str[value_start:pos].strip()
             else:
                 # 值不用花括号，找到下一个逗号或结束
                 value_start = pos
-                while pos < len(fields_str) and fields_str[pos] not in ',}':
-                    pos += 1
+                pos = _BARE_VALUE_RE.match(fields_str, pos).end()
                 value = fields_str[value_start:pos].strip()
 
             fields.append(f'{field_name} = {value}')
@@ -492,13 +799,11 @@ def format_bibtex(bibtex):
             if pos < len(fields_str) and fields_str[pos] == ',':
                 pos += 1
 
-        # 构建多行格式
-        formatted = entry_start + '\n'
-        for field in fields:
-            formatted += '  ' + field + ',\n'
+        # 构建多行格式（先收集到列表再一次性拼接，避免反复 += 复制字符串）
+        parts = [entry_start, '\n']
+        parts.extend('  ' + field + ',\n' for field in fields)
         # 移除最后一个逗号
-        formatted = formatted.rstrip(',\n') + '\n'
-        formatted += '}'
+        formatted = ''.join(parts).rstrip(',\n') + '\n}'
 
         # 截断作者列表
         formatted = apply_author_truncation(formatted)
@@ -528,22 +833,14 @@ def apply_author_truncation(bibtex):
     在完整的 BibTeX 条目中查找并截断 author 字段
     """
     # 查找 author 字段的起始位置
-    author_match = re.search(r'(author\s*=\s*\{)', bibtex, re.IGNORECASE)
+    author_match = _AUTHOR_START_RE.search(bibtex)
     if not author_match:
         return bibtex
 
     start_pos = author_match.end()
     # 找到对应的闭合花括号
-    brace_count = 1
-    pos = start_pos
-    while pos < len(bibtex) and brace_count > 0:
-        if bibtex[pos] == '{':
-            brace_count += 1
-        elif bibtex[pos] == '}':
-            brace_count -= 1
-        pos += 1
-
-    if brace_count != 0:
+    pos = _find_matching_brace(bibtex, start_pos)
+    if pos == -1:
         return bibtex
 
     # 提取作者字段内容
@@ -558,6 +855,148 @@ def apply_author_truncation(bibtex):
     return before + truncated_authors + after
 
 
+def query_provider(source, entry, args, query_tokens=None, cancel=None):
+    """查询单个数据源，返回 (source, bibtex)，失败时 bibtex 为 None"""
+    if source == 'semantic':
+        bibtex = get_bib_from_semantic_scholar(
+            entry['title'],
+            entry['citation_key'],
+            api_key=args.semantic_key,
+            similarity_threshold=args.similarity,
+            query_tokens=query_tokens,
+            mailto=args.mailto,
+            candidates=args.candidates,
+            cancel=cancel
+        )
+    elif source == 'dblp':
+        bibtex = get_bib_from_dblp(
+            entry['title'],
+            entry['citation_key'],
+            similarity_threshold=args.similarity,
+            query_tokens=query_tokens,
+            candidates=args.candidates,
+            cancel=cancel
+        )
+    else:
+        bibtex = get_bib_from_crossref(
+            entry['title'],
+            entry['citation_key'],
+            similarity_threshold=args.similarity,
+            query_tokens=query_tokens,
+            mailto=args.mailto,
+            candidates=args.candidates,
+            cancel=cancel
+        )
+    return source, bibtex
+
+
+def query_all_providers(entry, args, executor, cancel=None):
+    """
+    并发查询所有数据源，按优先级返回第一个成功的结果 (source, bibtex)
+    高优先级数据源成功后，通知仍在运行的低优先级查询放弃后续请求；
+    cancel 被外部设置（如 Ctrl-C）时所有查询都会放弃后续请求
+    """
+    # 原标题只分词一次，供所有数据源的相似度验证复用
+    query_tokens = _tokenize(entry['title'])
+    if cancel is None:
+        cancel = threading.Event()
+    futures = [
+        executor.submit(run_buffered, query_provider, source, entry, args, query_tokens, cancel)
+        for source in PROVIDERS
+    ]
+
+    for i, future in enumerate(futures):
+        if i > 0:
+            log(f"  → 切换到 {PROVIDER_NAMES[PROVIDERS[i]]}...")
+        (source, bibtex), output = future.result()
+        log(output, end='')
+        if bibtex:
+            cancel.set()
+            for pending in futures[i + 1:]:
+                pending.cancel()
+            return source, bibtex
+
+    return None, None
+
+
+class BibCache:
+    """
+    标题 → BibTeX 的本地缓存（SQLite）
+    以规范化标题为键，重复运行或标题重复时直接复用已验证的结果，不再查询网络
+    """
+
+    def __init__(self, path, ttl_days=30):
+        self.conn = sqlite3.connect(path)
+        self.ttl = ttl_days * 86400
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'normalized_title TEXT PRIMARY KEY, source TEXT, bibtex TEXT, ts INTEGER)'
+            )
+            # 清理过期条目
+            self.conn.execute('DELETE FROM cache WHERE ts < ?', (int(time.time()) - self.ttl,))
+
+    def get(self, title):
+        """查找缓存，命中时返回 (source, bibtex)，否则返回 None"""
+        key = normalize_title(title)
+        if not key:
+            return None
+        row = self.conn.execute(
+            'SELECT source, bibtex FROM cache WHERE normalized_title = ? AND ts >= ?',
+            (key, int(time.time()) - self.ttl)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, title, source, bibtex):
+        """保存查询成功的结果"""
+        key = normalize_title(title)
+        if not key:
+            return
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO cache (normalized_title, source, bibtex, ts) VALUES (?, ?, ?, ?)',
+                (key, source, bibtex, int(time.time()))
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def append_entry(f, bibtex):
+    """向输出文件追加一个条目并立即落盘（断点保护）"""
+    if f.tell():
+        f.write('\n\n')
+    f.write(bibtex)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def process_entry(entry, args, executor, stop, live_cancels):
+    """
+    在工作线程中查询单个条目，返回 (source, bibtex)；已被中断时直接返回
+    查询期间该条目的 cancel 事件登记在 live_cancels 中，中断时由主线程统一设置
+    """
+    if stop.is_set():
+        return None, None
+    cancel = threading.Event()
+    live_cancels.add(cancel)
+    # 登记前主线程可能已经遍历过 live_cancels，再检查一次避免漏掉中断
+    if stop.is_set():
+        cancel.set()
+    try:
+        return query_all_providers(entry, args, executor, cancel)
+    finally:
+        live_cancels.discard(cancel)
+
+
+def positive_int(value):
+    """argparse 类型：大于等于 1 的整数"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'必须是大于等于 1 的整数: {value}')
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='智能 BibTeX 更新：自动先用 Semantic Scholar（有API key），失败后切换到 DBLP，最后尝试 Crossref',
@@ -595,17 +1034,37 @@ def main():
     parser.add_argument('--semantic-key', '-k',
                        default=None,
                        help='Semantic Scholar API key (recommended for better rate limits)')
+    parser.add_argument('--mailto', default=None,
+                       help='联系邮箱，随 Crossref 请求发送以使用其 polite pool（推荐）')
     parser.add_argument('--similarity', type=float, default=0.7,
                        help='标题相似度阈值，0-1之间（默认: 0.8，即 80%%）')
+    parser.add_argument('--candidates', type=positive_int, default=3,
+                       help='每个数据源取回的候选结果数，从中选出标题最相似的一个（默认: 3）')
     parser.add_argument('--keep-original', action='store_true',
                        help='查询失败时保留原始条目')
-    parser.add_argument('--delay', type=int, default=1,
-                       help='每个查询之间的延迟秒数（默认: 1）')
+    parser.add_argument('--delay', type=float, default=None,
+                       help='同一服务器两次请求之间的最小间隔秒数（默认按服务器: Semantic Scholar 1，'
+                            '无 API key 时 3；DBLP 1；Crossref 0.1）')
+    parser.add_argument('--workers', type=positive_int, default=4,
+                       help='同时查询的条目数（默认: 4）')
     parser.add_argument('--force', action='store_true',
-                       help='强制重新查询所有条目（忽略已有结果）')
+                       help='强制重新查询所有条目（忽略已有结果和缓存）')
+    parser.add_argument('--cache', default='.bib_refiner_cache.sqlite',
+                       help='本地查询缓存文件（默认: .bib_refiner_cache.sqlite）')
+    parser.add_argument('--cache-ttl', type=int, default=30,
+                       help='缓存有效天数（默认: 30）')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='不使用本地查询缓存')
 
     args = parser.parse_args()
 
+    # 各服务器的请求间隔：无 API key 时 Semantic Scholar 限额约为 100 次 / 5 分钟
+    if args.delay is not None:
+        for host in _MIN_INTERVAL:
+            _MIN_INTERVAL[host] = args.delay
+    elif not args.semantic_key:
+        _MIN_INTERVAL['api.semanticscholar.org'] = 3.0
+
     # 读取输入文件
     try:
         with open(args.input, 'r', encoding='utf-8') as f:
@@ -623,137 +1082,177 @@ def main():
         sys.exit(1)
 
     # 读取已有的成功结果（断点续传）
+    # 运行中的结果先写入临时文件，结束后再替换输出文件；上次运行中断时留下的临时文件也一并读取
+    tmp_output = args.output + '.tmp'
     existing_entries = {}  # citation_key -> bibtex
     existing_keys = set()
-    if not args.force and os.path.exists(args.output):
-        print(f"发现已有结果文件: {args.output}")
+    for path in (args.output, tmp_output):
+        if args.force or not os.path.exists(path):
+            continue
+        print(f"发现已有结果文件: {path}")
         try:
-            with open(args.output, 'r', encoding='utf-8') as f:
+            with open(path, 'r', encoding='utf-8') as f:
                 existing_content = f.read()
-            existing_list = extract_bibtex_entries(existing_content)
-            for entry in existing_list:
-                existing_keys.add(entry['citation_key'])
-                existing_entries[entry['citation_key']] = entry['full_entry']
-            print(f"已有 {len(existing_keys)} 个成功条目，将跳过重复查询\n")
+            existing_entries.update(index_entries_by_key(existing_content))
+            existing_keys = set(existing_entries)
         except Exception as e:
             print(f"⚠ 读取已有结果失败: {e}，将重新查询所有条目\n")
             existing_keys = set()
             existing_entries = {}
+            break
+    if existing_keys:
+        print(f"已有 {len(existing_keys)} 个成功条目，将跳过重复查询\n")
 
     print(f"找到 {len(entries)} 个 BibTeX 条目")
     if existing_keys:
         to_process = len(entries) - len(existing_keys)
         print(f"需要处理: {to_process} 个（{len(existing_keys)} 个已完成）")
-    print("策略: Semantic Scholar (优先) → DBLP (次选) → Crossref (最后)")
+    print("策略: Semantic Scholar (优先) → DBLP (次选) → Crossref (最后)，并发查询后按优先级取结果")
     if args.semantic_key:
         print(f"Semantic Scholar API Key: {args.semantic_key[:8]}...")
     else:
         print("⚠ 警告: 未提供 Semantic Scholar API key，可能遇到速率限制")
     print("="*70)
 
-    # 处理每个条目
-    updated_entries = []
-    failed_titles = []  # 收集失败的标题
-    stats = {'crossref': 0, 'semantic': 0, 'dblp': 0, 'failed': 0, 'skipped': 0}
-
+    # 处理每个条目：多个条目同时在工作线程中查询（每个条目的各数据源再并发查询），
+    # 主线程按输入顺序取结果、打印并写入文件
+    provider_executor = ThreadPoolExecutor(max_workers=2 * len(PROVIDERS) * args.workers)
+    entry_executor = ThreadPoolExecutor(max_workers=args.workers)
+    stop = threading.Event()
+    live_cancels = set()  # 正在查询的条目的 cancel 事件
+    cache = None if args.no_cache else BibCache(args.cache, args.cache_ttl)
+    cached = {}  # idx -> (source, bibtex)，缓存命中的条目无需查询
+    pending = {}  # idx -> entry，需要联网查询的条目
+    duplicates = {}  # idx -> 相同标题首次出现的条目 idx，直接复用其查询结果
+    first_by_title = {}  # 规范化标题 -> idx
     for idx, entry in enumerate(entries, 1):
-        print(f"\n[{idx}/{len(entries)}] 处理: {entry['citation_key']}")
-        print(f"  标题: {entry['title']}")
-
-        # 检查是否已经查询成功（断点续传）
         if entry['citation_key'] in existing_keys:
-            print(f"  ⏭ 已存在，跳过")
-            updated_entries.append(existing_entries[entry['citation_key']])
-            stats['skipped'] += 1
             continue
+        # --force 时不读缓存（查询结果仍会写入缓存）
+        hit = cache.get(entry['title']) if cache and not args.force else None
+        if hit:
+            cached[idx] = hit
+            continue
+        key = normalize_title(entry['title'])
+        if key and key in first_by_title:
+            duplicates[idx] = first_by_title[key]
+            continue
+        if key:
+            first_by_title[key] = idx
+        pending[idx] = entry
+
+    # 带 DOI/arXiv ID 的条目先用一次批量请求查询 Semantic Scholar
+    prefetched = prefetch_semantic_scholar(
+        list(pending.values()),
+        api_key=args.semantic_key,
+        similarity_threshold=args.similarity
+    )
 
-        bibtex = None
-        source = None
-
-        # 步骤1: 先尝试 Semantic Scholar（覆盖最全面，有API key速度快）
-        bibtex = get_bib_from_semantic_scholar(
-            entry['title'],
-            entry['citation_key'],
-            api_key=args.semantic_key,
-            similarity_threshold=args.similarity
-        )
-
-        if bibtex:
-            source = 'semantic'
-            stats['semantic'] += 1
-        else:
-            # 步骤2: Semantic Scholar 失败，切换到 DBLP
-            print(f"  → 切换到 DBLP...")
-            time.sleep(1)  # 避免请求过快
-
-            bibtex = get_bib_from_dblp(
-                entry['title'],
-                entry['citation_key'],
-                similarity_threshold=args.similarity
+    futures = {}  # idx -> Future
+    for idx, entry in pending.items():
+        if entry['citation_key'] not in prefetched:
+            futures[idx] = entry_executor.submit(
+                run_buffered, process_entry, entry, args, provider_executor, stop, live_cancels
             )
 
-            if bibtex:
-                source = 'dblp'
-                stats['dblp'] += 1
-            else:
-                # 步骤3: DBLP 也失败，最后尝试 Crossref
-                print(f"  → 切换到 Crossref...")
-                time.sleep(1)  # 避免请求过快
-
-                bibtex = get_bib_from_crossref(
-                    entry['title'],
-                    entry['citation_key'],
-                    similarity_threshold=args.similarity
-                )
+    out = open(tmp_output, 'w', encoding='utf-8')
+    # 失败的标题逐行写入 error.txt（行缓冲，每条立即落盘）
+    error_file = 'error.txt'
+    err_f = open(error_file, 'w', encoding='utf-8', buffering=1)
+    updated_count = 0
+    results = {}  # idx -> (source, bibtex)，联网查询的原始结果，供重复标题复用
+    stats = {'crossref': 0, 'semantic': 0, 'dblp': 0, 'failed': 0, 'skipped': 0}
+    written_existing = set()  # 本次已写回临时文件的已有结果
+    finished = False
 
+    try:
+        for idx, entry in enumerate(entries, 1):
+            print(f"\n[{idx}/{len(entries)}] 处理: {entry['citation_key']}")
+            print(f"  标题: {entry['title']}")
+
+            # 检查是否已经查询成功（断点续传）
+            if entry['citation_key'] in existing_keys:
+                print(f"  ⏭ 已存在，跳过")
+                append_entry(out, existing_entries[entry['citation_key']])
+                written_existing.add(entry['citation_key'])
+                updated_count += 1
+                stats['skipped'] += 1
+                continue
+
+            if idx in cached:
+                source, bibtex = cached[idx]
+                bibtex = replace_citation_key_in_bibtex(bibtex, entry['citation_key'])
+                print(f"  [缓存] ✓ 命中 (来源: {PROVIDER_NAMES[source]})")
+            elif idx in duplicates:
+                first = duplicates[idx]
+                source, bibtex = results[first]
+                print(f"  ⏭ 与 [{first}] {entries[first - 1]['citation_key']} 标题相同，复用其查询结果")
                 if bibtex:
-                    source = 'crossref'
-                    stats['crossref'] += 1
-
-        # 处理结果
-        if bibtex:
-            # 格式化
-            bibtex = format_bibtex(bibtex)
-            updated_entries.append(bibtex)
-            print(f"  ✓ 已更新 (来源: {source.upper()})")
-
-            # 立即写入文件（断点保护）
-            output_text = "\n\n".join(updated_entries)
-            with open(args.output, 'w', encoding='utf-8') as f:
-                f.write(output_text)
-        else:
-            stats['failed'] += 1
-            # 记录失败的标题
-            failed_titles.append(entry['title'])
-
-            # 立即更新 error.txt
-            with open('error.txt', 'w', encoding='utf-8') as f:
-                for title in failed_titles:
-                    f.write(title + '\n')
-
-            if args.keep_original:
-                print(f"  ⚠ 查询失败，保留原始条目")
-                updated_entries.append(entry['full_entry'])
-                # 立即写入文件
-                output_text = "\n\n".join(updated_entries)
-                with open(args.output, 'w', encoding='utf-8') as f:
-                    f.write(output_text)
+                    bibtex = replace_citation_key_in_bibtex(bibtex, entry['citation_key'])
             else:
-                print(f"  ✗ 查询失败，跳过")
-
-        # 避免请求过快
-        if idx < len(entries):
-            time.sleep(args.delay)
-
-    # 保存结果
-    if updated_entries:
-        output_text = "\n\n".join(updated_entries)
+                if entry['citation_key'] in prefetched:
+                    source, bibtex = 'semantic', prefetched[entry['citation_key']]
+                    print(f"  [Semantic Scholar] ✓ 批量查询命中")
+                else:
+                    # 等待该条目的查询结果（Semantic Scholar / DBLP / Crossref 按优先级取结果）
+                    (source, bibtex), output = futures[idx].result()
+                    print(output, end='')
+                results[idx] = (source, bibtex)
+                if bibtex and cache:
+                    cache.put(entry['title'], source, bibtex)
+            if bibtex:
+                stats[source] += 1
 
-        with open(args.output, 'w', encoding='utf-8') as f:
-            f.write(output_text)
+            # 处理结果
+            if bibtex:
+                # 格式化
+                bibtex = format_bibtex(bibtex)
+                # 立即写入文件（断点保护）
+                append_entry(out, bibtex)
+                updated_count += 1
+                print(f"  ✓ 已更新 (来源: {source.upper()})")
+            else:
+                stats['failed'] += 1
+                # 记录失败的标题
+                err_f.write(entry['title'] + '\n')
+
+                if args.keep_original:
+                    print(f"  ⚠ 查询失败，保留原始条目")
+                    # 立即写入文件
+                    append_entry(out, entry['full_entry'])
+                    updated_count += 1
+                else:
+                    print(f"  ✗ 查询失败，跳过")
+        finished = True
+    except KeyboardInterrupt:
+        # 中断时取消尚未开始的条目，并让正在查询的条目放弃后续请求；
+        # 已写入的结果可在下次运行时续传
+        stop.set()
+        for cancel in list(live_cancels):
+            cancel.set()
+        for future in futures.values():
+            future.cancel()
+        raise
+    finally:
+        if not finished:
+            # 临时文件已被本次运行截断：把尚未轮到的已有结果补写回去，避免下次续传时丢失
+            input_keys = {entry['citation_key'] for entry in entries}
+            for key, bibtex in existing_entries.items():
+                if key in input_keys and key not in written_existing:
+                    append_entry(out, bibtex)
+        out.close()
+        err_f.close()
+        entry_executor.shutdown(wait=False)
+        provider_executor.shutdown(wait=False)
+        if cache:
+            cache.close()
+
+    # 保存结果：用临时文件原子替换输出文件
+    if updated_count:
+        os.replace(tmp_output, args.output)
 
         print("\n" + "="*70)
-        print(f"✓ 成功处理 {len(updated_entries)}/{len(entries)} 个条目")
+        print(f"✓ 成功处理 {updated_count}/{len(entries)} 个条目")
         if stats['skipped'] > 0:
             print(f"  - 已跳过（已有结果）: {stats['skipped']} 个")
         print(f"  - DBLP: {stats['dblp']} 个")
@@ -763,22 +1262,13 @@ def main():
             print(f"  - 失败: {stats['failed']} 个")
         print(f"✓ 已保存到: {args.output}")
 
-        # 保存失败的标题到 error.txt
-        if failed_titles:
-            error_file = 'error.txt'
-            with open(error_file, 'w', encoding='utf-8') as f:
-                for title in failed_titles:
-                    f.write(title + '\n')
+        if stats['failed'] > 0:
             print(f"✗ 失败的标题已保存到: {error_file}")
     else:
+        os.remove(tmp_output)
         print("\n✗ 没有成功更新任何条目", file=sys.stderr)
 
-        # 保存失败的标题
-        if failed_titles:
-            error_file = 'error.txt'
-            with open(error_file, 'w', encoding='utf-8') as f:
-                for title in failed_titles:
-                    f.write(title + '\n')
+        if stats['failed'] > 0:
             print(f"✗ 失败的标题已保存到: {error_file}")
 
         sys.exit(1)